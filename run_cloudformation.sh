@@ -105,7 +105,11 @@ cp src/*_layer.py ./layersbuild/python
 if [[ -f requirements.txt ]]
 then
     echo "Looking for python dependencies"
-    pip3 install -t build -r requirements.txt
+    # dependencies ship in the layer, which Lambda adds to sys.path from python/;
+    # orjson is a compiled extension, so fetch wheels built for the Lambda runtime
+    pip3 install -t layersbuild/python -r requirements.txt \
+      --platform manylinux2014_x86_64 --implementation cp --python-version 3.8 \
+      --only-binary=:all:
 fi
 
 if [[ -z ${org_role+x} ]];
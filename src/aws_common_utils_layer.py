@@ -5,21 +5,64 @@ unzipping notifications received from S3 etc.
 Typically this file can be part of AWS Lambda layer package
 """
 
-import json
 import logging
 import os
-import urllib
+import urllib.parse
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from gzip import GzipFile
 from io import BytesIO
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError, BotoCoreError
 
+try:
+    # orjson parses bytes directly and is considerably faster than the
+    # stdlib on large CloudTrail logs; fall back to json if unavailable
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    # ijson is only needed to stream records out of large S3 objects
+    import ijson
+except ImportError:
+    ijson = None
+
 # see RoleSessionName in
 # https://docs.aws.amazon.com/STS/latest/APIReference/API_AssumeRole.html
 SESSION_NAME_MIN_LENGTH = 2
 SESSION_NAME_MAX_LENGTH = 64
 
+# size of the chunks read from the decompressed S3 object stream
+GZIP_READ_CHUNK_SIZE = 128 * 1024
+
+# number of S3 objects fetched concurrently; the client connection pool
+# must be at least this large or workers will wait on connections
+S3_GET_OBJECT_MAX_WORKERS = 16
+S3_CLIENT_CONFIG = Config(max_pool_connections=32, retries={"max_attempts": 4})
+# boto3.Session -> S3 client; entries go away with their session
+_S3_CLIENTS = weakref.WeakKeyDictionary()
+
+# assumed role sessions are reused until this close to their expiration
+SESSION_EXPIRATION_MARGIN = timedelta(minutes=5)
+# (role_arn, session_name) -> (boto3.Session, credentials expiration)
+_SESSION_CACHE = {}
+
+# level names accepted by set_logging_level()
+_LOGGING_LEVELS = {
+    "INFO": logging.INFO,
+    "ERROR": logging.ERROR,
+    "WARNING": logging.WARNING,
+    "DEBUG": logging.DEBUG,
+    "CRITICAL": logging.CRITICAL,
+}
+
+# containers clear_empty_strings() descends into
+_CONTAINER_TYPES = (dict, list, set, tuple, frozenset)
+
 
 def handle_session_name_length(session_name):
     """
@@ -45,14 +88,24 @@ def get_session_with_arn(role_arn, session_name, base_session):
     base_session is the session used to assume the role;
         it must have permissions to assume the role.
     By default, base_session is the caller's regular boto3 session.
-    """
-    if not base_session:
-        base_session = boto3.Session()
 
+    Sessions assumed with the default base_session are cached
+    until shortly before their credentials expire.
+    """
     if not session_name:
         session_name = "aws_common_utils"
 
     session_name = handle_session_name_length(session_name)
+
+    use_cache = not base_session
+    cache_key = (role_arn, session_name)
+    if use_cache:
+        cached = _SESSION_CACHE.get(cache_key)
+        now = datetime.now(timezone.utc)
+        if cached and cached[1] - now > SESSION_EXPIRATION_MARGIN:
+            return cached[0]
+        base_session = boto3.Session()
+
     client = base_session.client("sts")
 
     try:
@@ -62,11 +115,17 @@ def get_session_with_arn(role_arn, session_name, base_session):
         secret = response["Credentials"]["SecretAccessKey"]
         session_token = response["Credentials"]["SessionToken"]
 
-        return boto3.Session(
+        session = boto3.Session(
             aws_access_key_id=access_key,
             aws_secret_access_key=secret,
             aws_session_token=session_token,
         )
+        if use_cache:
+            _SESSION_CACHE[cache_key] = (
+                session,
+                response["Credentials"]["Expiration"],
+            )
+        return session
     except (BotoCoreError, ClientError) as e:
         logging.error(
             "get_session_with_arn() failed trying to assume %s \
@@ -77,6 +136,13 @@ def get_session_with_arn(role_arn, session_name, base_session):
         raise e
 
 
+def clear_session_cache():
+    """
+    Forget every assumed role session cached by get_session_with_arn()
+    """
+    _SESSION_CACHE.clear()
+
+
 def get_session(account_id, role_name, session_name):
     """
     Returns a boto3.session.Session for account_id that assumes role_name role.
@@ -95,23 +161,55 @@ def clear_empty_strings(data):
     """
     Remove empty string values from data structs.
     For dict, deletes the empty string value and any corresponding key.
-    Since dicts are passed as references, dict changes are also in-place.
+    Dicts and lists are modified in-place; tuples and sets are
+    only rebuilt if they contain something that has to be removed.
 
     Returns the modified version of the data.
     """
-    if isinstance(data, dict):
-        for k, v in data.items():
-            if v == "":
-                del data[k]
-            else:
-                data[k] = clear_empty_strings(v)
-    elif isinstance(data, (list, set, tuple)):
-        # use list comprehension to filter out "" and modify items,
-        # then reconstruct as original data type
-        data = type(data)([clear_empty_strings(x) for x in data if x != ""])
-    elif data == "":
-        return None
-    return data
+    if not isinstance(data, _CONTAINER_TYPES):
+        return None if data == "" else data
+
+    # hold the root in a list so it can be replaced like any nested value;
+    # stack entries are (parent, key, rebuild_type) where a non-None
+    # rebuild_type converts parent[key] back once its items are processed
+    root = [data]
+    stack = [(root, 0, None)]
+    while stack:
+        parent, key, rebuild_type = stack.pop()
+        value = parent[key]
+        if rebuild_type is not None:
+            parent[key] = rebuild_type(value)
+            continue
+
+        if isinstance(value, dict):
+            # class identity check avoids calling __eq__ on every value
+            empty_keys = [k for k, v in value.items() if v.__class__ is str and not v]
+            for k in empty_keys:
+                del value[k]
+            stack.extend(
+                (value, k, None)
+                for k, v in value.items()
+                if isinstance(v, _CONTAINER_TYPES)
+            )
+            continue
+
+        if not isinstance(value, list):
+            if "" not in value and not any(
+                isinstance(x, _CONTAINER_TYPES) for x in value
+            ):
+                continue
+            # process as a list and convert back after nested items are done
+            stack.append((parent, key, type(value)))
+            value = list(value)
+            parent[key] = value
+
+        value[:] = [x for x in value if x.__class__ is not str or x]
+        stack.extend(
+            (value, i, None)
+            for i, x in enumerate(value)
+            if isinstance(x, _CONTAINER_TYPES)
+        )
+    return root[0]
 
 
 def _is_s3_notif(event):
@@ -128,6 +226,20 @@ def _is_s3_notif(event):
     )
 
 
+def _get_s3_objects_from_sns_msg_of_dict(session, event, get_objects_function):
+    """
+    Calls get_objects_function(session, s3_notification) for the S3
+    notification of an S3 event, or of every message of an SNS event.
+    """
+    objects = []
+    if _is_s3_notif(event):
+        return get_objects_function(session, event)
+    for record in event.get("Records", []):
+        message = record.get("Sns", {}).get("Message")
+        objects.extend(get_objects_function(session, json_loads(message)))
+    return objects
+
+
 def get_gzipped_s3_objects_from_sns_msg_of_dict(session, event):
     """
     get_s3_objects_from_sns_msg_of_dict() but with a predefined
@@ -137,27 +249,66 @@ def get_gzipped_s3_objects_from_sns_msg_of_dict(session, event):
     Will also detect if a regular S3 notif was received instead
     of an SNS dict and forward to appropriate getter function.
     """
-    objects = []
-    if _is_s3_notif(event):
-        return get_gzipped_s3_objects_from_dict(session, event)
-    for record in event.get("Records", []):
-        message = record.get("Sns", {}).get("Message")
-        objects.extend(get_gzipped_s3_objects_from_dict(session, json.loads(message)))
-    return objects
+    return _get_s3_objects_from_sns_msg_of_dict(
+        session, event, get_gzipped_s3_objects_from_dict
+    )
+
+
+def get_gzipped_s3_objects_from_sns_msg_of_dict_streaming(session, event):
+    """
+    get_gzipped_s3_objects_from_sns_msg_of_dict() but every object is
+    an iterator over its "Records" items instead of a dict.
+    See get_gzipped_s3_objects_from_dict_streaming().
+    """
+    return _get_s3_objects_from_sns_msg_of_dict(
+        session, event, get_gzipped_s3_objects_from_dict_streaming
+    )
 
 
 def default_unzip_s3_object_handler_function(response):
     """
     Utility to unzip S3 object
     """
-    bytestream = BytesIO(response["Body"].read())
-    raw_object = GzipFile(None, "rb", fileobj=bytestream).read()
-    try:
-        # decode if allowed
-        return_object = raw_object.decode("utf-8")
-    except AttributeError:
-        return_object = raw_object
-    return json.loads(return_object)
+    # decompress straight from the streaming body rather than buffering
+    # the whole compressed object in memory first
+    raw_object = bytearray()
+    with GzipFile(fileobj=response["Body"], mode="rb") as gzip_file:
+        chunk = gzip_file.read(GZIP_READ_CHUNK_SIZE)
+        while chunk:
+            raw_object += chunk
+            chunk = gzip_file.read(GZIP_READ_CHUNK_SIZE)
+    # orjson and json (3.6+) both accept bytes-like objects; no utf-8 decode
+    return json_loads(raw_object)
+
+
+def streaming_unzip_s3_object_handler_function(response):
+    """
+    Utility to download a gzipped S3 object and return an iterator that
+    lazily yields the items of its "Records" list while decompressing.
+
+    The compressed body is read right away, in the calling thread, so
+    concurrent callers download in parallel and no response is left open;
+    only the much larger decompressed JSON is never held in memory.
+
+    The iterator raises ValueError if the object is not valid JSON.
+    Falls back to default_unzip_s3_object_handler_function()
+    if ijson is not installed.
+    """
+    if ijson is None:
+        records = default_unzip_s3_object_handler_function(response)
+        return iter(records.get("Records", []))
+    return _iter_gzipped_records(BytesIO(response["Body"].read()))
+
+
+def _iter_gzipped_records(fileobj):
+    """
+    Yields the items of the "Records" list of gzipped JSON fileobj
+    """
+    with GzipFile(fileobj=fileobj, mode="rb") as gzip_file:
+        try:
+            yield from ijson.items(gzip_file, "Records.item", use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(str(e)) from e
 
 
 def get_gzipped_s3_objects_from_dict(session, event):
@@ -170,6 +321,32 @@ def get_gzipped_s3_objects_from_dict(session, event):
     )
 
 
+def get_gzipped_s3_objects_from_dict_streaming(session, event):
+    """
+    get_s3_objects_from_dict() but with a predefined object_handler_function
+    that returns an iterator over the "Records" items of gzipped objects.
+
+    Compressed objects are downloaded concurrently up front; they are only
+    decompressed and parsed while iterating, so the decoded JSON of an
+    object is never held in memory at once.
+    """
+    return get_s3_objects_from_dict(
+        session, event, streaming_unzip_s3_object_handler_function
+    )
+
+
+def get_s3_client(session):
+    """
+    Returns an S3 client of session, created once per session so
+    warm invocations do not have to load the service model again.
+    """
+    s3 = _S3_CLIENTS.get(session)
+    if s3 is None:
+        s3 = session.client("s3", config=S3_CLIENT_CONFIG)
+        _S3_CLIENTS[session] = s3
+    return s3
+
+
 def get_s3_objects_from_dict(session, event, object_handler_function):
     """
     Given a dict (e.g. event, notification), return a list of all
@@ -180,25 +357,34 @@ def get_s3_objects_from_dict(session, event, object_handler_function):
         JSON string and loads it as a dict.
     """
 
-    objects = []
-    s3 = session.client("s3")
+    s3 = get_s3_client(session)
+    bucket_keys = []
     # Get the object from the event and show its content type
     for record in event.get("Records", []):
         bucket = record["s3"]["bucket"]["name"]
         unprocessed_key = record["s3"]["object"]["key"]
-        # urllib changes structure and encoding is different
-        # between python 2 and 3
+        # keys in S3 notifications are URL encoded; most CloudTrail keys
+        # contain nothing to decode, so skip unquoting those
         key = (
             urllib.parse.unquote_plus(unprocessed_key)
-            # if sys.version_info[0] >= 3
-            # else urllib.unquote_plus(unprocessed_key.encode("utf-8"))
+            if "%" in unprocessed_key or "+" in unprocessed_key
+            else unprocessed_key
         )
         logging.info("Bucket: %s. Key: %s", bucket, key)
+        bucket_keys.append((bucket, key))
 
-        # get S3 object and add it to return list
-        response = s3.get_object(Bucket=bucket, Key=key)
-        objects.append(object_handler_function(response))
-    return objects
+    def get_object(bucket_key):
+        response = s3.get_object(Bucket=bucket_key[0], Key=bucket_key[1])
+        return object_handler_function(response)
+
+    if len(bucket_keys) <= 1:
+        return [get_object(bucket_key) for bucket_key in bucket_keys]
+
+    # get S3 objects concurrently; map() keeps the order of the event records
+    with ThreadPoolExecutor(
+        max_workers=min(S3_GET_OBJECT_MAX_WORKERS, len(bucket_keys))
+    ) as executor:
+        return list(executor.map(get_object, bucket_keys))
 
 
 def set_logging_level(
@@ -206,33 +392,22 @@ def set_logging_level(
 ):
     """
     Set logging level according to whatever value is stored in the environment
-    variable. Order of "if" checks is prioritized by anticipated frequency
-    of use. See actual levels here:
+    variable. See actual levels here:
     https://docs.python.org/3/library/logging.html#levels
-    Provide value for either environment_variable_key or manually_set_level,
-    not both. Defaults to using environment_variable_key 'LOGGING_LEVEL'
+    manually_set_level takes precedence over environment_variable_key,
+    which defaults to 'LOGGING_LEVEL'.
     If providing manually_set_level, please provide the string (e.g. "INFO"),
     not the class (e.g. logging.INFO)
 
     Returns logger object
     """
     logger = logging.getLogger()
-    level = (
-        os.environ.get(environment_variable_key)
-        if environment_variable_key
-        else manually_set_level
+    level = manually_set_level or os.environ.get(
+        environment_variable_key or "LOGGING_LEVEL"
     )
-    if level == "INFO":
-        logger.setLevel(logging.INFO)
-    elif level == "ERROR":
-        logger.setLevel(logging.ERROR)
-    elif level == "WARNING":
-        logger.setLevel(logging.WARNING)
-    elif level == "DEBUG":
-        logger.setLevel(logging.DEBUG)
-    elif level == "CRITICAL":
-        logger.setLevel(logging.CRITICAL)
-    else:
+    chosen_level = _LOGGING_LEVELS.get(level)
+    if chosen_level is None:
         logging.error("Received level of %s, defaulting to NOTSET", level)
-        logger.setLevel(logging.NOTSET)
+        chosen_level = logging.NOTSET
+    logger.setLevel(chosen_level)
     return logger
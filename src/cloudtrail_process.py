@@ -3,19 +3,123 @@ Function that receives and processes CloudTrail events via S3 object
 creation notifications
 """
 
-import json
 import logging
 import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain
+from operator import itemgetter
 
 import boto3
+from botocore.config import Config
 from aws_common_utils_layer import (
-    get_gzipped_s3_objects_from_sns_msg_of_dict,
+    get_gzipped_s3_objects_from_sns_msg_of_dict_streaming,
     set_logging_level,
 )
 
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    from json import dumps as json_dumps
+
 set_logging_level()
 
+# number of concurrent Support Case Lambda invocations; the client
+# connection pool must be at least this large
+INVOKE_MAX_WORKERS = 32
+
+# Support Cases
+# Currently not including event AddAttachmentsToSet
+# Including AddCommunicationToCase to cover when case is reopened
+SUPPORT_CASE_EVENT_NAMES = frozenset(
+    ("CreateCase", "ResolveCase", "AddCommunicationToCase")
+)
+
+# fields every CloudTrail record is expected to have
+get_account_id_and_event_name = itemgetter("recipientAccountId", "eventName")
+
+# created once per Lambda container and reused across warm invocations
+SESSION = boto3.session.Session()
+
+
+@lru_cache(maxsize=None)
+def get_lambda_client():
+    """
+    Returns the Lambda client, created on first use so the module
+    can be imported without an AWS region set.
+    """
+    return SESSION.client(
+        "lambda", config=Config(max_pool_connections=INVOKE_MAX_WORKERS)
+    )
+
+
+def invoke_support_cases_aggregator(lambda_client, function_name, account_id, case_ids):
+    """
+    Asynchronously invoke the Support Case Lambda function_name
+    for case_ids of account_id
+    """
+    lambda_client.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json_dumps({"AccountId": account_id, "CaseIds": list(case_ids)}),
+    )
+
+
+def get_case_id(record):
+    """
+    Returns the Support case id of a CloudTrail record, or None.
+
+    CreateCase returns the case id in responseElements while other events
+    pass it in requestParameters; either may be missing or null.
+    """
+    try:
+        case_id = record["responseElements"]["caseId"]
+    except (KeyError, TypeError):
+        case_id = None
+    if case_id:
+        return case_id
+    try:
+        return record["requestParameters"]["caseId"]
+    except (KeyError, TypeError):
+        return None
+
+
+def find_support_cases(records):
+    """
+    Returns a dict of account id to the Support case ids that CloudTrail
+    records show were created, resolved or updated. Case ids are stored
+    as the keys of a dict to dedupe them while keeping the order found.
+    """
+    support_cases_to_check = defaultdict(dict)
+
+    for record in records:
+        try:
+            account_id, event_name = get_account_id_and_event_name(record)
+        except KeyError:
+            continue
+
+        if event_name in SUPPORT_CASE_EVENT_NAMES:
+            case_id = get_case_id(record)
+
+            if case_id:
+                logging.info(
+                    "%s: Support case %s found with event %s",
+                    account_id,
+                    case_id,
+                    event_name,
+                )
+                support_cases_to_check[account_id][case_id] = None
+            else:
+                logging.error(
+                    "CaseIdMissingError %s: \
+                    Support case without caseId found with event %s; %s",
+                    account_id,
+                    event_name,
+                    record,
+                )
+    return support_cases_to_check
+
 
 def lambda_handler(event, context):
     """
@@ -38,53 +142,33 @@ def lambda_handler(event, context):
 
     logging.debug(context)
 
-    session = boto3.session.Session()
     try:
-        objects = get_gzipped_s3_objects_from_sns_msg_of_dict(session, event)
+        objects = get_gzipped_s3_objects_from_sns_msg_of_dict_streaming(SESSION, event)
+        logging.info("Retrieved %s S3 objects", len(objects))
+        # objects are iterators of records; reading them parses each object
+        support_cases_to_check = find_support_cases(chain.from_iterable(objects))
     except ValueError as e:
         logging.warning("Retrieved non-JSON object %s", str(e))
         return
 
-    logging.info("Retrieved S3 objects:\n%s", objects)
-
-    support_cases_to_check = defaultdict(set)
-
-    for obj in objects:
-        for record in obj.get("Records", []):
-            account_id = record.get("recipientAccountId")
-            event_name = record.get("eventName")
-
-            # Support Cases
-            # Currently not including event AddAttachmentsToSet
-            # Including AddCommunicationToCase to cover when case is reopened
-            if event_name in ["CreateCase", "ResolveCase", "AddCommunicationToCase"]:
-                case_id = record.get("responseElements", {}).get(
-                    "caseId"
-                ) or record.get("requestParameters", {}).get("caseId")
-
-                if case_id:
-                    logging.info(
-                        "%s: Support case %s found with event %s",
-                        account_id,
-                        case_id,
-                        event_name,
-                    )
-                    support_cases_to_check[account_id].add(case_id)
-                else:
-                    logging.error(
-                        "CaseIdMissingError %s: \
-                        Support case without caseId found with event %s; %s",
-                        account_id,
-                        event_name,
-                        record,
-                    )
-
     # Invoke Support Case Lambda to aggregate support case info
-    client = session.client("lambda")
-    for account_id, case_ids in support_cases_to_check.items():
-        cases = list(case_ids)
-        client.invoke(
-            FunctionName=os.environ["SUPPORT_CASES_AGGREGATOR_LAMBDA_NAME"],
-            InvocationType="Event",
-            Payload=json.dumps({"AccountId": account_id, "CaseIds": cases}),
+    if not support_cases_to_check:
+        return
+    # resolved once here so a missing variable raises KeyError with its name
+    # before any invoke, rather than inside the pool threads
+    invoke = partial(
+        invoke_support_cases_aggregator,
+        get_lambda_client(),
+        os.environ["SUPPORT_CASES_AGGREGATOR_LAMBDA_NAME"],
+    )
+    with ThreadPoolExecutor(
+        max_workers=min(INVOKE_MAX_WORKERS, len(support_cases_to_check))
+    ) as executor:
+        # consume the results so any invoke error is raised here
+        list(
+            executor.map(
+                invoke,
+                support_cases_to_check.keys(),
+                support_cases_to_check.values(),
+            )
         )
@@ -5,7 +5,10 @@ service case information
 
 import logging
 import os
+from collections import deque
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
 
 import boto3
 from botocore.config import Config
@@ -27,6 +30,59 @@ DEFAULT_CASE_LOOKBACK_DAYS = 60
 # where the support case was opened
 ORG_SUPPORT_VIEWER_ROLE = "GetSupportInfoRole"
 
+# created once per Lambda container and reused across warm invocations
+SESSION = boto3.session.Session()
+# account id -> (assumed role session, support client of that session)
+_SUPPORT_CLIENTS = {}
+
+# support:DescribeCases accepts at most 100 case ids per call
+DESCRIBE_CASES_MAX_CASE_IDS = 100
+# describe_cases error code of a case id that does not exist
+CASE_ID_NOT_FOUND_ERROR_CODE = "CaseIdNotFound"
+
+# describe_cases parameters shared by the periodic reloads
+DESCRIBE_CASES_KWARGS = {"includeResolvedCases": True, "maxResults": 100}
+
+
+@lru_cache(maxsize=None)
+def get_support_cases_table():
+    """
+    Returns the support cases DynamoDB table, created on first use so the
+    module can be imported without an AWS region or table name set.
+    """
+    return SESSION.resource("dynamodb").Table(os.environ["SUPPORT_CASES_TABLE_NAME"])
+
+
+def batch_case_ids(case_ids, batch_size=DESCRIBE_CASES_MAX_CASE_IDS):
+    """
+    Split case_ids into lists of at most batch_size case ids
+    so each list can be passed to a single describe_cases call.
+    """
+    case_ids_iter = iter(case_ids)
+    batch = list(islice(case_ids_iter, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(case_ids_iter, batch_size))
+
+
+def get_support_client(account_id):
+    """
+    Returns a Support client for account_id using ORG_SUPPORT_VIEWER_ROLE.
+
+    Clients are cached per account for as long as get_session() keeps
+    returning the same cached session, so warm invocations do not have
+    to load the service model again.
+    """
+    session = get_session(account_id, ORG_SUPPORT_VIEWER_ROLE, "get_support_info")
+    cached = _SUPPORT_CLIENTS.get(account_id)
+    if cached and cached[0] is session:
+        return cached[1]
+
+    # support client has difficult in regions that aren't us-east-1 strangely
+    client = session.client("support", region_name="us-east-1")
+    _SUPPORT_CLIENTS[account_id] = (session, client)
+    return client
+
 
 def list_account_ids():
     """
@@ -45,7 +101,7 @@ def list_account_ids():
             role_arn=assumed_role_arn, session_name="listAccountIds", base_session=None
         )
     else:
-        session = boto3.session.Session()  # get local session
+        session = SESSION  # use local session
     try:
         client = session.client(
             "organizations", config=Config(retries={"max_attempts": 8})
@@ -75,30 +131,27 @@ def get_all_existing_cases(recent_cases_only):
     to reload the support cases DynamoDB table.
     """
     account_ids = list_account_ids()
+    support_cases_table = get_support_cases_table()
 
-    dynamodb_session = boto3.session.Session()
-    dynamodb = dynamodb_session.resource("dynamodb")
-    support_cases_table = dynamodb.Table(os.environ.get("SUPPORT_CASES_TABLE_NAME"))
+    # same lookback window for every account
+    after_time = (
+        datetime.now() - timedelta(days=DEFAULT_CASE_LOOKBACK_DAYS)
+    ).isoformat()
     for account_id in account_ids:
-        session = get_session(account_id, ORG_SUPPORT_VIEWER_ROLE, "get_support_info")
-        client = session.client("support")
+        client = get_support_client(account_id)
         if recent_cases_only:
-            update_recent_cases(support_cases_table, account_id, client)
+            update_recent_cases(support_cases_table, account_id, client, after_time)
         else:
             update_all_cases(support_cases_table, account_id, client)
 
 
-def update_recent_cases(
-    support_cases_table, account_id, client, days=DEFAULT_CASE_LOOKBACK_DAYS
-):
+def update_recent_cases(support_cases_table, account_id, client, after_time):
     """
-    Only retrieve updates within last X days to avoid unnecessary duplication
+    Only retrieve updates after after_time (ISO 8601 string)
+    to avoid unnecessary duplication
     """
-    kwargs = {
-        "includeResolvedCases": True,
-        "maxResults": 100,
-        "afterTime": (datetime.now() - timedelta(days=days)).isoformat(),
-    }
+    # update_cases_helper adds nextToken, so each account gets its own copy
+    kwargs = dict(DESCRIBE_CASES_KWARGS, afterTime=after_time)
     update_cases_helper(support_cases_table, account_id, client, kwargs)
 
 
@@ -106,7 +159,7 @@ def update_all_cases(support_cases_table, account_id, client):
     """
     For a manual update of every case.
     """
-    kwargs = {"includeResolvedCases": True, "maxResults": 100}
+    kwargs = dict(DESCRIBE_CASES_KWARGS)
     update_cases_helper(support_cases_table, account_id, client, kwargs)
 
 
@@ -119,24 +172,34 @@ def update_cases_helper(support_cases_table, account_id, client, kwargs):
     :param kwargs: pagination params
     :return: None
     """
-    try:
-        case_response = client.describe_cases(**kwargs)
-    except (ClientError, BotoCoreError) as e:
-        if e.response["Error"]["Code"] == "SubscriptionRequiredException":
-            logging.error("Failed subscription for account %s; ignoring", account_id)
-            return
-        raise e
-    for case in case_response.get("cases"):
-        # WARNING: recentCommunications is only the last 5 communications.
-        if case.get("recentCommunications", {}).get("nextToken"):
-            del case["recentCommunications"]["nextToken"]
-
-        # put updated info into table
-        case["AccountId"] = account_id
-        support_cases_table.put_item(Item=case)
-    if "nextToken" in case_response:
-        kwargs["nextToken"] = case_response["nextToken"]
-        update_cases_helper(support_cases_table, account_id, client, kwargs)
+    # caseId is the table key; overwrite_by_pkeys drops a buffered item
+    # when the same case shows up again before the batch is flushed
+    with support_cases_table.batch_writer(
+        overwrite_by_pkeys=["caseId"]
+    ) as support_table_batch:
+        while True:
+            try:
+                case_response = client.describe_cases(**kwargs)
+            except (ClientError, BotoCoreError) as e:
+                if e.response["Error"]["Code"] == "SubscriptionRequiredException":
+                    logging.error(
+                        "Failed subscription for account %s; ignoring", account_id
+                    )
+                    return
+                raise e
+            for case in case_response.get("cases", []):
+                # WARNING: recentCommunications is only the last 5 communications.
+                if case.get("recentCommunications", {}).get("nextToken"):
+                    del case["recentCommunications"]["nextToken"]
+
+                # put updated info into table
+                case["AccountId"] = account_id
+                support_table_batch.put_item(Item=case)
+
+            next_token = case_response.get("nextToken")
+            if not next_token:
+                return
+            kwargs["nextToken"] = next_token
 
 
 def lambda_handler(event, context):
@@ -169,52 +232,63 @@ def lambda_handler(event, context):
     case_ids = event.get("CaseIds")
 
     # assume role
-    member_account_session = get_session(
-        account_id, ORG_SUPPORT_VIEWER_ROLE, "get_support_info"
-    )
-    # support client has difficult in regions that aren't us-east-1 strangely
-    client = member_account_session.client("support", region_name="us-east-1")
+    client = get_support_client(account_id)
 
     # Use current role
-    dynamodb_session = boto3.session.Session()
-    dynamodb = dynamodb_session.resource("dynamodb")
-    support_cases_table = dynamodb.Table(os.environ.get("SUPPORT_CASES_TABLE_NAME"))
+    support_cases_table = get_support_cases_table()
     with support_cases_table.batch_writer() as support_table_batch:
-        for case_id in case_ids:
+        pending_batches = deque(batch_case_ids(case_ids))
+        while pending_batches:
+            case_id_batch = pending_batches.popleft()
 
             # get support info
             try:
                 case_response = client.describe_cases(
-                    caseIdList=[case_id], includeResolvedCases=True
+                    caseIdList=case_id_batch,
+                    includeResolvedCases=True,
+                    maxResults=DESCRIBE_CASES_MAX_CASE_IDS,
                 )
             except ClientError as e:
-                logging.error("error on %s", case_id)
+                logging.error("error on %s", case_id_batch)
                 if e.response["Error"]["Code"] == "SubscriptionRequiredException":
                     logging.error(
                         "Failed subscription for account %s, "
                         "need Enterprise Support; ignoring",
                         account_id,
                     )
-                    support_cases_table.put_item(
-                        Item={
-                            "caseId": case_id,
-                            "status": "** N/A; " "Must Enable Enterprise Support **",
-                        }
+                    for case_id in case_id_batch:
+                        support_cases_table.put_item(
+                            Item={
+                                "caseId": case_id,
+                                "status": "** N/A; "
+                                "Must Enable Enterprise Support **",
+                            }
+                        )
+                    continue
+                if (
+                    e.response["Error"]["Code"] == CASE_ID_NOT_FOUND_ERROR_CODE
+                    and len(case_id_batch) > 1
+                ):
+                    # a single unknown case id fails the whole call; retry the
+                    # ids one at a time so the valid cases are still stored
+                    # and only the unknown case id raises
+                    pending_batches.extendleft(
+                        [case_id] for case_id in reversed(case_id_batch)
                     )
                     continue
                 raise e
             except Exception as e:
-                logging.error("error on %s", case_id)
+                logging.error("error on %s", case_id_batch)
                 raise e
-            case = case_response.get("cases")[0]
-            # WARNING: recentCommunications is only the last 5 communications.
-            if case.get("recentCommunications", {}).get("nextToken"):
-                del case["recentCommunications"]["nextToken"]
+            for case in case_response.get("cases", []):
+                # WARNING: recentCommunications is only the last 5 communications.
+                if case.get("recentCommunications", {}).get("nextToken"):
+                    del case["recentCommunications"]["nextToken"]
 
-            clear_empty_strings(case)
+                clear_empty_strings(case)
 
-            # put updated info into table
-            case["AccountId"] = account_id
-            support_table_batch.put_item(Item=case)
+                # put updated info into table
+                case["AccountId"] = account_id
+                support_table_batch.put_item(Item=case)
 
     return True
@@ -0,0 +1,8 @@
+"""
+Tests of the Lambda functions and their layer in src/
+"""
+import os
+import sys
+
+# Lambda functions import the layer module by its top-level name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
@@ -1,10 +1,30 @@
 """
 Test class to test common utils
 """
+import gzip
+import logging
+import os
 import unittest
 import string
 import random
-from src.aws_common_utils_layer import handle_session_name_length
+import threading
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from unittest import mock
+
+import aws_common_utils_layer
+from aws_common_utils_layer import (
+    clear_empty_strings,
+    clear_session_cache,
+    default_unzip_s3_object_handler_function,
+    get_s3_client,
+    get_gzipped_s3_objects_from_dict_streaming,
+    get_s3_objects_from_dict,
+    get_session_with_arn,
+    handle_session_name_length,
+    set_logging_level,
+    streaming_unzip_s3_object_handler_function,
+)
 
 
 class AWSCommonUtils(unittest.TestCase):
@@ -26,3 +46,209 @@ class AWSCommonUtils(unittest.TestCase):
             [random.choice(string.ascii_letters) for _ in range(63)]
         )
         self.assertEqual(len(handle_session_name_length(random_long_string)), 63)
+
+    def test_default_unzip_s3_object_handler_function(self):
+        """
+        Test gzipped JSON S3 object body is unzipped and loaded as a dict
+        :return:
+        """
+        body = gzip.compress(b'{"Records": [{"eventName": "CreateCase"}]}')
+        response = {"Body": BytesIO(body)}
+        self.assertEqual(
+            default_unzip_s3_object_handler_function(response),
+            {"Records": [{"eventName": "CreateCase"}]},
+        )
+
+    def test_get_s3_objects_from_dict(self):
+        """
+        Test every S3 object in the event is fetched and returned in order
+        :return:
+        """
+        keys = ["key{}".format(i) for i in range(20)]
+        event = {
+            "Records": [
+                {"s3": {"bucket": {"name": "bucket"}, "object": {"key": key}}}
+                for key in keys
+            ]
+        }
+        session = mock.Mock()
+        session.client.return_value.get_object.side_effect = (
+            lambda Bucket, Key: {"Body": Key}
+        )
+        objects = get_s3_objects_from_dict(
+            session, event, lambda response: response["Body"]
+        )
+        self.assertEqual(objects, keys)
+
+    def test_set_logging_level(self):
+        """
+        Test manually set level takes precedence over the environment variable
+        :return:
+        """
+        logger = logging.getLogger()
+        original_level = logger.level
+        try:
+            with mock.patch.dict(os.environ, {"LOGGING_LEVEL": "DEBUG"}):
+                self.assertEqual(set_logging_level().level, logging.DEBUG)
+                self.assertEqual(set_logging_level("ERROR").level, logging.ERROR)
+                self.assertEqual(set_logging_level("foo").level, logging.NOTSET)
+        finally:
+            logger.setLevel(original_level)
+
+    def test_get_s3_objects_from_dict_unquotes_keys(self):
+        """
+        Test URL encoded S3 keys are decoded before fetching the object
+        :return:
+        """
+        keys = ["plain/key.json.gz", "with+space%3A.json.gz"]
+        event = {
+            "Records": [
+                {"s3": {"bucket": {"name": "bucket"}, "object": {"key": key}}}
+                for key in keys
+            ]
+        }
+        session = mock.Mock()
+        session.client.return_value.get_object.side_effect = (
+            lambda Bucket, Key: {"Body": Key}
+        )
+        objects = get_s3_objects_from_dict(
+            session, event, lambda response: response["Body"]
+        )
+        self.assertEqual(objects, ["plain/key.json.gz", "with space:.json.gz"])
+
+    def test_streaming_unzip_s3_object_handler_function(self):
+        """
+        Test records of a gzipped JSON S3 object body are yielded one by one
+        and invalid JSON raises ValueError
+        :return:
+        """
+        body = gzip.compress(
+            b'{"Records": [{"eventName": "CreateCase"}, {"eventName": "Foo"}]}'
+        )
+        records = streaming_unzip_s3_object_handler_function({"Body": BytesIO(body)})
+        self.assertEqual(
+            list(records), [{"eventName": "CreateCase"}, {"eventName": "Foo"}]
+        )
+
+        body = gzip.compress(b'{"Records": [{"eventName": ')
+        records = streaming_unzip_s3_object_handler_function({"Body": BytesIO(body)})
+        with self.assertRaises(ValueError):
+            list(records)
+
+    @mock.patch.object(aws_common_utils_layer, "boto3")
+    def test_get_session_with_arn_caches_sessions(self, boto3_mock):
+        """
+        Test assumed role sessions are reused until close to expiration
+        :return:
+        """
+        clear_session_cache()
+        self.addCleanup(clear_session_cache)
+        sts_client = boto3_mock.Session.return_value.client.return_value
+
+        def assume_role_expiring_in(expires_in):
+            sts_client.assume_role.return_value = {
+                "Credentials": {
+                    "AccessKeyId": "key",
+                    "SecretAccessKey": "secret",
+                    "SessionToken": "token",
+                    "Expiration": datetime.now(timezone.utc) + expires_in,
+                }
+            }
+
+        assume_role_expiring_in(timedelta(hours=1))
+        session = get_session_with_arn("arn", "name", None)
+        self.assertIs(get_session_with_arn("arn", "name", None), session)
+        self.assertEqual(sts_client.assume_role.call_count, 1)
+
+        clear_session_cache()
+        assume_role_expiring_in(timedelta(minutes=1))
+        get_session_with_arn("arn", "name", None)
+        get_session_with_arn("arn", "name", None)
+        self.assertEqual(sts_client.assume_role.call_count, 3)
+
+    def test_clear_empty_strings(self):
+        """
+        Test empty strings are removed from nested data, dicts in-place
+        :return:
+        """
+        case = {
+            "caseId": "case-123",
+            "subject": "",
+            "recentCommunications": {
+                "communications": [{"body": "hi", "attachmentSet": ""}, ""],
+                "nextToken": "",
+            },
+            "ccEmailAddresses": ("", "a@example.com"),
+        }
+        self.assertIs(clear_empty_strings(case), case)
+        self.assertEqual(
+            case,
+            {
+                "caseId": "case-123",
+                "recentCommunications": {"communications": [{"body": "hi"}]},
+                "ccEmailAddresses": ("a@example.com",),
+            },
+        )
+        self.assertIsNone(clear_empty_strings(""))
+
+    def test_get_s3_client(self):
+        """
+        Test the S3 client is created once per session
+        :return:
+        """
+        session = mock.Mock()
+        s3 = get_s3_client(session)
+        self.assertIs(get_s3_client(session), s3)
+        session.client.assert_called_once()
+        self.assertIsNot(get_s3_client(mock.Mock()), s3)
+
+    def test_get_gzipped_s3_objects_from_dict_streaming_reads_in_workers(self):
+        """
+        Test S3 object bodies are fully read by the pool workers before the
+        records are iterated, and records come back in event order
+        :return:
+        """
+        read_threads = []
+
+        class Body(BytesIO):
+            """
+            S3 object body that records the threads reading it
+            """
+
+            def read(self, *args):
+                read_threads.append(threading.current_thread())
+                return super().read(*args)
+
+        keys = ["key{}".format(i) for i in range(3)]
+        event = {
+            "Records": [
+                {"s3": {"bucket": {"name": "bucket"}, "object": {"key": key}}}
+                for key in keys
+            ]
+        }
+        session = mock.Mock()
+        session.client.return_value.get_object.side_effect = (
+            lambda Bucket, Key: {
+                "Body": Body(
+                    gzip.compress(b'{"Records": [{"eventName": "%s"}]}' % Key.encode())
+                )
+            }
+        )
+        objects = get_gzipped_s3_objects_from_dict_streaming(session, event)
+
+        self.assertEqual(len(read_threads), len(keys))
+        self.assertNotIn(threading.main_thread(), read_threads)
+        self.assertEqual(
+            [record["eventName"] for obj in objects for record in obj], keys
+        )
+        self.assertEqual(len(read_threads), len(keys))
+
+    @mock.patch.object(aws_common_utils_layer, "ijson", None)
+    def test_streaming_unzip_s3_object_handler_function_without_ijson(self):
+        """
+        Test records are still returned when ijson is not installed
+        :return:
+        """
+        body = gzip.compress(b'{"Records": [{"eventName": "CreateCase"}]}')
+        records = streaming_unzip_s3_object_handler_function({"Body": BytesIO(body)})
+        self.assertEqual(list(records), [{"eventName": "CreateCase"}])
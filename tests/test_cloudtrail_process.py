@@ -0,0 +1,160 @@
+"""
+Test class to test behaviour of CloudTrail events processing
+"""
+import json
+import os
+import unittest
+from unittest import mock
+
+import cloudtrail_process
+
+
+def support_case_record(account_id, case_id, event_name="CreateCase"):
+    """
+    Returns a CloudTrail record of a Support case event
+    """
+    return {
+        "recipientAccountId": account_id,
+        "eventName": event_name,
+        "responseElements": {"caseId": case_id},
+    }
+
+
+class CloudTrailProcess(unittest.TestCase):
+    """
+    unittest class for CloudTrail events processing
+    """
+
+    def run_lambda_handler(self, records, lambda_client):
+        """
+        Runs lambda_handler on an event whose single S3 object holds records
+        :return:
+        """
+        with mock.patch.object(
+            cloudtrail_process,
+            "get_gzipped_s3_objects_from_sns_msg_of_dict_streaming",
+            return_value=[iter(records)],
+        ), mock.patch.object(
+            cloudtrail_process, "get_lambda_client", return_value=lambda_client
+        ):
+            cloudtrail_process.lambda_handler({}, None)
+
+    @mock.patch.dict(os.environ, {"SUPPORT_CASES_AGGREGATOR_LAMBDA_NAME": "aggregator"})
+    def test_lambda_handler_invokes_aggregator_per_account(self):
+        """
+        Test the Support Case Lambda is invoked asynchronously once per account
+        with that account's deduped case ids in the order they were found
+        :return:
+        """
+        lambda_client = mock.Mock()
+        self.run_lambda_handler(
+            [
+                support_case_record("111", "case-2"),
+                support_case_record("222", "case-9"),
+                support_case_record("111", "case-1"),
+                support_case_record("111", "case-2", event_name="ResolveCase"),
+            ],
+            lambda_client,
+        )
+
+        self.assertEqual(lambda_client.invoke.call_count, 2)
+        self.assertEqual(
+            {
+                (call.kwargs["FunctionName"], call.kwargs["InvocationType"])
+                for call in lambda_client.invoke.call_args_list
+            },
+            {("aggregator", "Event")},
+        )
+        # accounts are invoked concurrently, so compare payloads by account
+        payloads = sorted(
+            (
+                json.loads(call.kwargs["Payload"])
+                for call in lambda_client.invoke.call_args_list
+            ),
+            key=lambda payload: payload["AccountId"],
+        )
+        self.assertEqual(
+            payloads,
+            [
+                {"AccountId": "111", "CaseIds": ["case-2", "case-1"]},
+                {"AccountId": "222", "CaseIds": ["case-9"]},
+            ],
+        )
+
+    def test_lambda_handler_requires_aggregator_lambda_name(self):
+        """
+        Test a missing SUPPORT_CASES_AGGREGATOR_LAMBDA_NAME raises KeyError
+        before anything is invoked
+        :return:
+        """
+        lambda_client = mock.Mock()
+        with mock.patch.dict(os.environ), self.assertRaisesRegex(
+            KeyError, "SUPPORT_CASES_AGGREGATOR_LAMBDA_NAME"
+        ):
+            os.environ.pop("SUPPORT_CASES_AGGREGATOR_LAMBDA_NAME", None)
+            self.run_lambda_handler(
+                [support_case_record("111", "case-1")], lambda_client
+            )
+
+        lambda_client.invoke.assert_not_called()
+
+    def test_get_case_id(self):
+        """
+        Test case id is read from responseElements, falling back to
+        requestParameters when it is missing, empty or null
+        :return:
+        """
+        get_case_id = cloudtrail_process.get_case_id
+        self.assertEqual(
+            get_case_id({"responseElements": {"caseId": "case-1"}}), "case-1"
+        )
+        self.assertEqual(
+            get_case_id(
+                {"responseElements": None, "requestParameters": {"caseId": "case-2"}}
+            ),
+            "case-2",
+        )
+        self.assertEqual(
+            get_case_id(
+                {
+                    "responseElements": {"caseId": ""},
+                    "requestParameters": {"caseId": "case-3"},
+                }
+            ),
+            "case-3",
+        )
+        self.assertIsNone(get_case_id({"responseElements": None}))
+        self.assertIsNone(get_case_id({"requestParameters": None}))
+
+    def test_find_support_cases_skips_incomplete_records(self):
+        """
+        Test records missing recipientAccountId or eventName are skipped,
+        as are events other than Support case events
+        :return:
+        """
+        records = [
+            {"eventName": "CreateCase", "responseElements": {"caseId": "case-1"}},
+            {"recipientAccountId": "111", "responseElements": {"caseId": "case-2"}},
+            support_case_record("111", "case-3", event_name="DescribeCases"),
+            support_case_record("111", "case-4", event_name="ResolveCase"),
+        ]
+        self.assertEqual(
+            cloudtrail_process.find_support_cases(records), {"111": {"case-4": None}}
+        )
+
+    def test_find_support_cases_dedupes_in_order(self):
+        """
+        Test case ids are deduped per account keeping first-seen order
+        :return:
+        """
+        records = [
+            support_case_record("111", "case-2"),
+            support_case_record("222", "case-9"),
+            support_case_record("111", "case-1"),
+            support_case_record("111", "case-2", event_name="AddCommunicationToCase"),
+            support_case_record("111", "case-3", event_name="ResolveCase"),
+        ]
+        support_cases = cloudtrail_process.find_support_cases(records)
+        self.assertEqual(list(support_cases), ["111", "222"])
+        self.assertEqual(list(support_cases["111"]), ["case-2", "case-1", "case-3"])
+        self.assertEqual(list(support_cases["222"]), ["case-9"])
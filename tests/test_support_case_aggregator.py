@@ -1,7 +1,30 @@
 """
 Test class to test behaviour of SupportCaseAggregator
 """
+import os
 import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+import support_cases_aggregator
+
+
+def client_error(code):
+    """
+    Returns a describe_cases ClientError with error code code
+    """
+    return ClientError({"Error": {"Code": code, "Message": code}}, "DescribeCases")
+
+
+def describe_cases(**kwargs):
+    """
+    Fake support:DescribeCases that knows every case id except "bad"
+    """
+    case_ids = kwargs["caseIdList"]
+    if "bad" in case_ids:
+        raise client_error("CaseIdNotFound")
+    return {"cases": [{"caseId": case_id, "subject": ""} for case_id in case_ids]}
 
 
 class SupportCaseAggregator(unittest.TestCase):
@@ -15,4 +38,246 @@ class SupportCaseAggregator(unittest.TestCase):
         correctly updates DDB table
         :return:
         """
-        self.assertEqual("foo".upper(), "FOO")
+        support_clients = {"111": mock.Mock(), "222": mock.Mock()}
+        support_clients["111"].describe_cases.side_effect = [
+            {"cases": [{"caseId": "case-1"}], "nextToken": "page-2"},
+            {"cases": [{"caseId": "case-2"}]},
+        ]
+        support_clients["222"].describe_cases.return_value = {
+            "cases": [{"caseId": "case-3"}]
+        }
+        table = mock.MagicMock()
+        with mock.patch.object(
+            support_cases_aggregator, "list_account_ids", return_value=["111", "222"]
+        ), mock.patch.object(
+            support_cases_aggregator,
+            "get_support_client",
+            side_effect=support_clients.get,
+        ), mock.patch.object(
+            support_cases_aggregator, "get_support_cases_table", return_value=table
+        ):
+            support_cases_aggregator.get_all_existing_cases(recent_cases_only=True)
+
+        first_calls = [
+            call.kwargs for call in support_clients["111"].describe_cases.call_args_list
+        ]
+        second_calls = [
+            call.kwargs for call in support_clients["222"].describe_cases.call_args_list
+        ]
+        self.assertEqual(len(first_calls), 2)
+        self.assertEqual(first_calls[1]["nextToken"], "page-2")
+        # the second account starts from the first page of the same lookback
+        self.assertEqual(
+            second_calls,
+            [
+                {
+                    "includeResolvedCases": True,
+                    "maxResults": 100,
+                    "afterTime": first_calls[0]["afterTime"],
+                }
+            ],
+        )
+        self.assertNotIn("nextToken", first_calls[0])
+        self.assertNotIn("nextToken", support_cases_aggregator.DESCRIBE_CASES_KWARGS)
+        writer = table.batch_writer.return_value.__enter__.return_value
+        self.assertEqual(
+            [call.kwargs["Item"] for call in writer.put_item.call_args_list],
+            [
+                {"caseId": "case-1", "AccountId": "111"},
+                {"caseId": "case-2", "AccountId": "111"},
+                {"caseId": "case-3", "AccountId": "222"},
+            ],
+        )
+
+    @mock.patch.dict(os.environ, {"SUPPORT_CASES_TABLE_NAME": "cases"})
+    @mock.patch.object(support_cases_aggregator, "SESSION")
+    def test_get_support_cases_table(self, session_mock):
+        """
+        Test the DynamoDB table is created on first use and then reused
+        :return:
+        """
+        support_cases_aggregator.get_support_cases_table.cache_clear()
+        try:
+            table = support_cases_aggregator.get_support_cases_table()
+            self.assertIs(support_cases_aggregator.get_support_cases_table(), table)
+            session_mock.resource.return_value.Table.assert_called_once_with("cases")
+        finally:
+            support_cases_aggregator.get_support_cases_table.cache_clear()
+
+    def run_lambda_handler(self, case_ids, support_client, table):
+        """
+        Runs lambda_handler for case_ids with mocked Support and DynamoDB
+        :return: mocked batch writer of table
+        """
+        with mock.patch.object(
+            support_cases_aggregator, "get_support_client", return_value=support_client
+        ), mock.patch.object(
+            support_cases_aggregator, "get_support_cases_table", return_value=table
+        ):
+            support_cases_aggregator.lambda_handler(
+                {"AccountId": "123", "CaseIds": case_ids}, None
+            )
+        return table.batch_writer.return_value.__enter__.return_value
+
+    def test_lambda_handler_batches_case_ids(self):
+        """
+        Test case ids are described in batches of 100 and every case is stored
+        :return:
+        """
+        case_ids = ["case-{}".format(i) for i in range(150)]
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = describe_cases
+        writer = self.run_lambda_handler(case_ids, support_client, mock.MagicMock())
+
+        batches = [
+            call.kwargs["caseIdList"]
+            for call in support_client.describe_cases.call_args_list
+        ]
+        self.assertEqual(batches, [case_ids[:100], case_ids[100:]])
+        self.assertEqual(
+            [call.kwargs["Item"] for call in writer.put_item.call_args_list],
+            [{"caseId": case_id, "AccountId": "123"} for case_id in case_ids],
+        )
+
+    def test_lambda_handler_subscription_required(self):
+        """
+        Test every case id of a batch gets a placeholder without Enterprise Support
+        :return:
+        """
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = client_error(
+            "SubscriptionRequiredException"
+        )
+        table = mock.MagicMock()
+        writer = self.run_lambda_handler(["case-1", "case-2"], support_client, table)
+
+        self.assertEqual(
+            [call.kwargs["Item"]["caseId"] for call in table.put_item.call_args_list],
+            ["case-1", "case-2"],
+        )
+        writer.put_item.assert_not_called()
+
+    def test_lambda_handler_retries_failed_batch_per_case_id(self):
+        """
+        Test a batch failing on one case id is retried one case id at a time,
+        storing the cases before the failing one
+        :return:
+        """
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = describe_cases
+        table = mock.MagicMock()
+        writer = table.batch_writer.return_value.__enter__.return_value
+        with self.assertRaises(ClientError):
+            self.run_lambda_handler(["case-1", "bad", "case-2"], support_client, table)
+
+        self.assertEqual(
+            [
+                call.kwargs["caseIdList"]
+                for call in support_client.describe_cases.call_args_list
+            ],
+            [["case-1", "bad", "case-2"], ["case-1"], ["bad"]],
+        )
+        self.assertEqual(
+            [call.kwargs["Item"]["caseId"] for call in writer.put_item.call_args_list],
+            ["case-1"],
+        )
+
+    def test_lambda_handler_raises_other_errors_without_retry(self):
+        """
+        Test errors other than an unknown case id are raised for the whole
+        batch instead of being retried one case id at a time
+        :return:
+        """
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = client_error(
+            "ThrottlingException"
+        )
+        with self.assertRaises(ClientError):
+            self.run_lambda_handler(
+                ["case-1", "case-2"], support_client, mock.MagicMock()
+            )
+
+        support_client.describe_cases.assert_called_once()
+
+    def test_update_cases_helper_paginates(self):
+        """
+        Test nextToken is carried into the next describe_cases call
+        and pagination stops once no nextToken is returned
+        :return:
+        """
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = [
+            {"cases": [{"caseId": "case-1"}], "nextToken": "page-2"},
+            {"cases": [{"caseId": "case-2"}], "nextToken": "page-3"},
+            {"cases": []},
+        ]
+        support_cases_aggregator.update_cases_helper(
+            mock.MagicMock(), "123", support_client, {"maxResults": 100}
+        )
+
+        self.assertEqual(
+            [call.kwargs for call in support_client.describe_cases.call_args_list],
+            [
+                {"maxResults": 100},
+                {"maxResults": 100, "nextToken": "page-2"},
+                {"maxResults": 100, "nextToken": "page-3"},
+            ],
+        )
+
+    def test_update_cases_helper_subscription_required(self):
+        """
+        Test a subscription error mid-pagination returns cleanly
+        :return:
+        """
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = [
+            {"cases": [{"caseId": "case-1"}], "nextToken": "page-2"},
+            client_error("SubscriptionRequiredException"),
+        ]
+        table = mock.MagicMock()
+        support_cases_aggregator.update_cases_helper(table, "123", support_client, {})
+
+        self.assertEqual(support_client.describe_cases.call_count, 2)
+        writer = table.batch_writer.return_value.__enter__.return_value
+        writer.put_item.assert_called_once_with(
+            Item={"caseId": "case-1", "AccountId": "123"}
+        )
+
+    def test_update_cases_helper_writes_through_batch_writer(self):
+        """
+        Test every case of every page is written through the batch writer
+        with AccountId set and recentCommunications nextToken dropped
+        :return:
+        """
+        support_client = mock.Mock()
+        support_client.describe_cases.side_effect = [
+            {
+                "cases": [
+                    {
+                        "caseId": "case-1",
+                        "recentCommunications": {"communications": [], "nextToken": "t"},
+                    },
+                    {"caseId": "case-2"},
+                ],
+                "nextToken": "page-2",
+            },
+            {"cases": [{"caseId": "case-3"}]},
+        ]
+        table = mock.MagicMock()
+        support_cases_aggregator.update_cases_helper(table, "123", support_client, {})
+
+        table.batch_writer.assert_called_once_with(overwrite_by_pkeys=["caseId"])
+        writer = table.batch_writer.return_value.__enter__.return_value
+        self.assertEqual(
+            [call.kwargs["Item"] for call in writer.put_item.call_args_list],
+            [
+                {
+                    "caseId": "case-1",
+                    "recentCommunications": {"communications": []},
+                    "AccountId": "123",
+                },
+                {"caseId": "case-2", "AccountId": "123"},
+                {"caseId": "case-3", "AccountId": "123"},
+            ],
+        )
+        table.put_item.assert_not_called()